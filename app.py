@@ -9,25 +9,54 @@ import os
 import json
 import threading
 import time
-import zipfile
+import gc
 import shutil
-from datetime import datetime, timedelta
+from collections import deque
+from itertools import groupby
+from datetime import datetime
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash
+from flask import (Flask, render_template, request, jsonify, send_file, redirect, url_for, flash,
+                   Response, stream_with_context)
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
+import pandas as pd
 import logging
 
+try:
+    import orjson  # optional: faster JSON encoding for the API endpoints
+except ImportError:
+    orjson = None
+
 # Import our enhanced downloader functionality
 from oceanos_hycom_download import (
-    Config, download_file_with_retry, combine_files, 
+    Config, download_many, combine_with_redownload,
     get_hycom_url, redownload_failed, safe_open_dataset,
-    write_netcdf_with_fallback
+    build_encoding, write_zip_archive, write_zarr_archive,
+    remove_source_files, download_filename, build_download_items
 )
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = 'hycom_downloader_secret_key_2024'
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        return orjson.dumps(obj, option=option, default=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Cap on the per-file name lists kept in download_status (bounded memory on long runs)
+MAX_TRACKED_FILES = 10_000
+# Rebuild status_message only every N completed files
+STATUS_MESSAGE_EVERY = 4
+
 # Global variables for download status
 download_status = {
     'is_running': False,
@@ -38,9 +67,47 @@ download_status = {
     'error': None,
     'start_time': None,
     'end_time': None,
-    'downloaded_files': [],
-    'failed_files': []
+    'downloaded_files': deque(maxlen=MAX_TRACKED_FILES),
+    'failed_files': deque(maxlen=MAX_TRACKED_FILES)
 }
+# Guards download_status (shared with the download thread pool) and wakes
+# /api/status/stream listeners whenever it changes
+status_cv = threading.Condition()
+_status_version = 0
+# Download lifecycle: _worker_active is set from start until the worker has fully
+# exited (cleanup included); stop_requested is the worker's cancel signal
+_start_lock = threading.Lock()
+_worker_active = threading.Event()
+stop_requested = threading.Event()
+
+# Seconds between SSE keep-alive comments when nothing changes
+STATUS_STREAM_KEEPALIVE = 15
+
+def _notify_status():
+    """Record a download_status change; call with status_cv held"""
+    global _status_version
+    _status_version += 1
+    status_cv.notify_all()
+
+def update_status(**fields):
+    """Update download_status and notify stream listeners"""
+    with status_cv:
+        download_status.update(fields)
+        _notify_status()
+
+def _status_snapshot():
+    """JSON-ready copy of download_status; call with status_cv held"""
+    return {key: list(value) if isinstance(value, deque) else value
+            for key, value in download_status.items()}
+
+# /api/files listing, reused while the data directory's mtime is unchanged
+_files_cache = {'mtime': None, 'payload': None}
+_files_lock = threading.Lock()
+
+def invalidate_files_cache():
+    """Drop the cached listing (in-place size changes do not bump the directory mtime)"""
+    with _files_lock:
+        _files_cache['mtime'] = None
 
 # Setup logging
 logging.basicConfig(
@@ -73,7 +140,10 @@ def get_config():
         'date_end': Config.DATE_END,
         'variables': Config.VARIABLES,
         'max_retries': Config.MAX_RETRIES,
-        'timeout': Config.TIMEOUT
+        'timeout': Config.TIMEOUT,
+        'max_workers': Config.MAX_WORKERS,
+        'days_per_request': Config.DAYS_PER_REQUEST,
+        'output_format': Config.OUTPUT_FORMAT
     })
 
 @app.route('/api/config', methods=['POST'])
@@ -82,16 +152,27 @@ def update_config():
     try:
         data = request.get_json()
         
+        # Parse and validate everything first so a rejected request changes nothing
+        updates = {
+            'WEST_LON': float(data.get('west_lon', Config.WEST_LON)),
+            'EAST_LON': float(data.get('east_lon', Config.EAST_LON)),
+            'SOUTH_LAT': float(data.get('south_lat', Config.SOUTH_LAT)),
+            'NORTH_LAT': float(data.get('north_lat', Config.NORTH_LAT)),
+            'DATE_START': data.get('date_start', Config.DATE_START),
+            'DATE_END': data.get('date_end', Config.DATE_END),
+            'VARIABLES': data.get('variables', Config.VARIABLES),
+            'MAX_RETRIES': int(data.get('max_retries', Config.MAX_RETRIES)),
+            'TIMEOUT': int(data.get('timeout', Config.TIMEOUT)),
+            'MAX_WORKERS': max(1, int(data.get('max_workers', Config.MAX_WORKERS))),
+            'DAYS_PER_REQUEST': max(1, int(data.get('days_per_request', Config.DAYS_PER_REQUEST))),
+            'OUTPUT_FORMAT': data.get('output_format', Config.OUTPUT_FORMAT),
+        }
+        if updates['OUTPUT_FORMAT'] not in ('netcdf', 'zarr'):
+            raise ValueError(f"output_format must be 'netcdf' or 'zarr', got {updates['OUTPUT_FORMAT']!r}")
+        
         # Update configuration
-        Config.WEST_LON = float(data.get('west_lon', Config.WEST_LON))
-        Config.EAST_LON = float(data.get('east_lon', Config.EAST_LON))
-        Config.SOUTH_LAT = float(data.get('south_lat', Config.SOUTH_LAT))
-        Config.NORTH_LAT = float(data.get('north_lat', Config.NORTH_LAT))
-        Config.DATE_START = data.get('date_start', Config.DATE_START)
-        Config.DATE_END = data.get('date_end', Config.DATE_END)
-        Config.VARIABLES = data.get('variables', Config.VARIABLES)
-        Config.MAX_RETRIES = int(data.get('max_retries', Config.MAX_RETRIES))
-        Config.TIMEOUT = int(data.get('timeout', Config.TIMEOUT))
+        for name, value in updates.items():
+            setattr(Config, name, value)
         
         return jsonify({'status': 'success', 'message': 'Configuration updated successfully'})
     except Exception as e:
@@ -100,15 +181,41 @@ def update_config():
 @app.route('/api/status')
 def get_status():
     """Get download status"""
-    return jsonify(download_status)
+    with status_cv:
+        snapshot = _status_snapshot()
+    return jsonify(snapshot)
+
+@app.route('/api/status/stream')
+def stream_status():
+    """Server-Sent Events: push download status only when it changes"""
+    def events():
+        last_version = None
+        while True:
+            with status_cv:
+                if _status_version == last_version:
+                    status_cv.wait(timeout=STATUS_STREAM_KEEPALIVE)
+                if _status_version == last_version:
+                    snapshot = None
+                else:
+                    last_version = _status_version
+                    snapshot = _status_snapshot()
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {app.json.dumps(snapshot)}\n\n"
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/start_download', methods=['POST'])
 def start_download():
     """Start download process"""
-    global download_status
-    
-    if download_status['is_running']:
-        return jsonify({'status': 'error', 'message': 'Download is already running'}), 400
+    # Check-and-set under one lock so concurrent POSTs cannot both start a worker
+    with _start_lock:
+        if _worker_active.is_set():
+            return jsonify({'status': 'error', 'message': 'Download is already running'}), 409
+        _worker_active.set()
+        stop_requested.clear()
     
     try:
         # Start download in background thread
@@ -118,18 +225,17 @@ def start_download():
         
         return jsonify({'status': 'success', 'message': 'Download started'})
     except Exception as e:
+        _worker_active.clear()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/stop_download', methods=['POST'])
 def stop_download():
     """Stop download process"""
-    global download_status
-    
-    if not download_status['is_running']:
+    if not _worker_active.is_set() or stop_requested.is_set():
         return jsonify({'status': 'error', 'message': 'No download is running'}), 400
     
-    download_status['is_running'] = False
-    download_status['status_message'] = 'Download stopped by user'
+    stop_requested.set()
+    update_status(is_running=False, status_message='Download stopped by user')
     
     return jsonify({'status': 'success', 'message': 'Download stopped'})
 
@@ -137,23 +243,33 @@ def stop_download():
 def list_files():
     """List downloaded files"""
     try:
-        files = []
         data_dir = Path(Config.BASE_DIR)
+        mtime = data_dir.stat().st_mtime_ns if data_dir.exists() else None
         
+        with _files_lock:
+            if mtime is not None and _files_cache['mtime'] == mtime:
+                return jsonify(_files_cache['payload'])
+        
+        entries = []
         if data_dir.exists():
-            for file_path in data_dir.glob('*.zip'):
-                stat = file_path.stat()
-                files.append({
-                    'name': file_path.name,
-                    'size': stat.st_size,
-                    'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                    'path': str(file_path)
-                })
+            # scandir reuses the directory read for type checks; one stat per archive
+            with os.scandir(data_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.zip') and entry.is_file():
+                        entries.append((entry, entry.stat()))
         
         # Sort by creation time (newest first)
-        files.sort(key=lambda x: x['created'], reverse=True)
+        entries.sort(key=lambda item: item[1].st_ctime, reverse=True)
         
-        return jsonify({'files': files})
+        payload = {'files': [{
+            'name': entry.name,
+            'size': stat.st_size,
+            'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+            'path': entry.path
+        } for entry, stat in entries]}
+        with _files_lock:
+            _files_cache.update({'mtime': mtime, 'payload': payload})
+        return jsonify(payload)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -161,12 +277,15 @@ def list_files():
 def download_file(filename):
     """Download a file"""
     try:
-        file_path = Path(Config.BASE_DIR) / secure_filename(filename)
+        file_path = (Path(Config.BASE_DIR) / secure_filename(filename)).resolve()
         
-        if not file_path.exists():
+        if not file_path.is_file():
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
         
-        return send_file(file_path, as_attachment=True)
+        # Conditional response: honours Range/If-Range (resumable downloads) and
+        # If-None-Match/If-Modified-Since (304 for unchanged archives)
+        return send_file(file_path, as_attachment=True, conditional=True, etag=True,
+                         last_modified=file_path.stat().st_mtime, max_age=0)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -180,6 +299,7 @@ def delete_file(filename):
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
         
         file_path.unlink()
+        invalidate_files_cache()
         return jsonify({'status': 'success', 'message': 'File deleted successfully'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -187,10 +307,11 @@ def delete_file(filename):
 def download_worker():
     """Background worker for downloading data using enhanced processing"""
     global download_status
+    completed = False
     
     try:
         # Initialize status
-        download_status.update({
+        update_status(**{
             'is_running': True,
             'progress': 0,
             'total_files': 0,
@@ -199,10 +320,13 @@ def download_worker():
             'error': None,
             'start_time': datetime.now().isoformat(),
             'end_time': None,
-            'downloaded_files': [],
-            'failed_files': []
+            'downloaded_files': deque(maxlen=MAX_TRACKED_FILES),
+            'failed_files': deque(maxlen=MAX_TRACKED_FILES)
         })
         
+        # TEMP_DIR is removed at the end of every run; recreate it for this one
+        Config.setup_directories()
+        
         # Parse date range
         start_date_obj = datetime.strptime(Config.DATE_START, '%Y-%m-%d')
         end_date_obj = datetime.strptime(Config.DATE_END, '%Y-%m-%d')
@@ -212,134 +336,145 @@ def download_worker():
         logger.info(f"Variables: {Config.VARIABLES}")
         logger.info(f"Geographic bounds: {Config.SOUTH_LAT}°N to {Config.NORTH_LAT}°N, {Config.WEST_LON}°E to {Config.EAST_LON}°E")
         
-        # Calculate total files
-        total_days = (end_date_obj - start_date_obj).days + 1
-        total_files = total_days * len(Config.VARIABLES)
-        download_status['total_files'] = total_files
+        # All requested days, built once; months are consecutive runs of this array
+        dates = pd.date_range(start_date_obj, end_date_obj, freq='D').to_pydatetime()
+        months = [list(group) for _, group in groupby(dates, key=lambda d: (d.year, d.month))]
+        
+        # Calculate total files (one per DAYS_PER_REQUEST-day request and variable)
+        total_files = sum(len(build_download_items(month, Config.VARIABLES)) for month in months)
+        update_status(total_files=total_files)
         
         logger.info(f"Starting download: {total_files} files from {Config.DATE_START} to {Config.DATE_END}")
         
         # Process by month (following pure.py approach)
-        current_date = start_date_obj
         downloaded_files = []
         failed_items = []
+        # Set when any item or month ends up missing; TEMP_DIR is then kept for a re-run
+        incomplete = False
         
-        while current_date <= end_date_obj and download_status['is_running']:
-            # Calculate month boundaries (following pure.py logic)
-            month_start = current_date
-            # End of this calendar month
-            if current_date.month == 12:
-                month_end = datetime(current_date.year, 12, 31)
-            else:
-                month_end = datetime(current_date.year, current_date.month + 1, 1) - timedelta(days=1)
-            # Cap by DATE_END
-            month_end = min(month_end, end_date_obj)
-            if month_end < month_start:
+        for dates_in_month in months:
+            if stop_requested.is_set():
                 break
             
-            # Generate dates in month
-            dates_in_month = []
-            temp_date = month_start
-            while temp_date <= month_end:
-                dates_in_month.append(temp_date)
-                temp_date += timedelta(days=1)
-            
-            total_files_month = len(dates_in_month) * len(Config.VARIABLES)
+            # Month slice, already capped by DATE_START/DATE_END
+            month_start, month_end = dates_in_month[0], dates_in_month[-1]
+            items = build_download_items(dates_in_month, Config.VARIABLES)
+            total_files_month = len(items)
             
             logger.info(f"\nProcessing month: {month_start.strftime('%Y-%m')} (capped end: {month_end.strftime('%Y-%m-%d')})")
-            download_status['status_message'] = f"Processing {month_start.strftime('%Y-%m')}..."
+            update_status(status_message=f"Processing {month_start.strftime('%Y-%m')}...")
             
-            downloaded_files_month = []
-            failed_items_month = []
+            # One result slot per item, in request order: Path, False (failed) or None (not run)
+            month_results = [None] * total_files_month
+            slots = {item: i for i, item in enumerate(items)}
             
-            # Download files for this month
-            for date in dates_in_month:
-                if not download_status['is_running']:
-                    break
-                    
-                for var in Config.VARIABLES:
-                    if not download_status['is_running']:
-                        break
-                    
-                    filename = f"hycom_{var}_{date.strftime('%Y%m%d')}.nc"
+            def record_result(item, file_path):
+                """Book one finished download item into its month slot and download_status"""
+                filename = download_filename(*item)
+                month_results[slots[item]] = file_path or False
+                with status_cv:
                     download_status['current_file'] = filename
-                    
-                    file_path = download_file_with_retry(date, var)
                     if file_path:
-                        downloaded_files_month.append(file_path)
-                        downloaded_files.append(file_path)
                         download_status['downloaded_files'].append(filename)
                     else:
-                        failed_items_month.append((date, var))
-                        failed_items.append((date, var))
                         download_status['failed_files'].append(filename)
                     
                     # Update progress
-                    download_status['progress'] += 1
-                    progress_percent = (download_status['progress'] / total_files) * 100
-                    download_status['status_message'] = f"Downloaded {download_status['progress']}/{total_files} files ({progress_percent:.1f}%)"
+                    progress = download_status['progress'] = download_status['progress'] + 1
+                    if progress % STATUS_MESSAGE_EVERY == 0 or progress == total_files:
+                        progress_percent = (progress / total_files) * 100
+                        download_status['status_message'] = f"Downloaded {progress}/{total_files} files ({progress_percent:.1f}%)"
+                    _notify_status()
+            
+            # Download concurrently (network I/O bound); files left in TEMP_DIR by an
+            # interrupted run for the same bounding box are reused without a request. A stop request drops
+            # queued downloads and lets in-flight ones finish
+            for item, file_path in download_many(items, should_stop=stop_requested.is_set):
+                record_result(item, file_path)
+            
+            downloaded_files_month = [p for p in month_results if p]
+            failed_items_month = [item for item, p in zip(items, month_results) if p is False]
+            downloaded_files.extend(downloaded_files_month)
+            failed_items.extend(failed_items_month)
             
             # Try to redownload failed files
-            if failed_items_month and download_status['is_running']:
+            if failed_items_month and not stop_requested.is_set():
                 logger.warning(f"Initial failures: {len(failed_items_month)}. Attempting redownload pass...")
-                download_status['status_message'] = f"Retrying failed downloads for {month_start.strftime('%Y-%m')}..."
+                update_status(status_message=f"Retrying failed downloads for {month_start.strftime('%Y-%m')}...")
                 recovered, remaining = redownload_failed(failed_items_month, attempts=1)
                 downloaded_files_month.extend(recovered)
                 downloaded_files.extend(recovered)
                 
                 # Update status
-                for path in recovered:
-                    filename = path.name
-                    if filename in download_status['failed_files']:
-                        download_status['failed_files'].remove(filename)
-                    download_status['downloaded_files'].append(filename)
+                with status_cv:
+                    for path in recovered:
+                        filename = path.name
+                        if filename in download_status['failed_files']:
+                            download_status['failed_files'].remove(filename)
+                        download_status['downloaded_files'].append(filename)
+                    _notify_status()
                 
                 if remaining:
+                    incomplete = True
                     logger.warning(f"Still failed after redownload: {len(remaining)} items")
             
             logger.info(f"Downloaded {len(downloaded_files_month)}/{total_files_month} files for {month_start.strftime('%Y-%m')}")
             
             # Combine files for this month if we have any
-            if downloaded_files_month and download_status['is_running']:
+            if downloaded_files_month and not stop_requested.is_set():
                 try:
                     logger.info(f"Combining files for {month_start.strftime('%Y-%m')}...")
-                    download_status['status_message'] = f"Combining files for {month_start.strftime('%Y-%m')}..."
+                    update_status(status_message=f"Combining files for {month_start.strftime('%Y-%m')}...")
                     
-                    combined = combine_files(downloaded_files_month)
+                    # Unreadable downloads are re-fetched; the ones that stay broken are lost
+                    combined, lost_items = combine_with_redownload(downloaded_files_month,
+                                                                   chunks=Config.COMBINE_CHUNKS, parallel=True)
+                    if lost_items:
+                        incomplete = True
+                        lost_names = [download_filename(*item) for item in lost_items]
+                        logger.warning(f"{len(lost_items)} files unreadable and missing from "
+                                       f"{month_start.strftime('%Y-%m')}: {lost_names}")
+                        lost_set = set(lost_names)
+                        downloaded_files[:] = [p for p in downloaded_files if p.name not in lost_set]
+                        failed_items.extend(lost_items)
+                        with status_cv:
+                            for filename in lost_names:
+                                if filename in download_status['downloaded_files']:
+                                    download_status['downloaded_files'].remove(filename)
+                                download_status['failed_files'].append(filename)
+                            _notify_status()
                     
                     # Create filename based on month (following pure.py approach)
                     timestamp = month_start.strftime('%Y%m')
-                    nc_filename = f"HYCOM_combined_{timestamp}.nc"
                     zip_filename = f"HYCOM_data_{timestamp}.zip"
-                    nc_path = Config.BASE_DIR / nc_filename
                     zip_path = Config.BASE_DIR / zip_filename
+                    update_status(status_message=f"Creating {zip_filename}...")
                     
-                    # Encoding only for numeric variables (compression-ready)
-                    encoding = {}
-                    for name, da in combined.data_vars.items():
-                        if da.dtype.kind in "ifub":
-                            encoding[name] = {'zlib': True, 'complevel': 6}
-                    
-                    logger.info(f"Saving NetCDF file: {nc_filename}")
-                    download_status['status_message'] = f"Creating {zip_filename}..."
-                    
-                    # Use enhanced write function with fallback
-                    write_engine_used = write_netcdf_with_fallback(combined, nc_path, encoding)
-                    
-                    logger.info(f"Creating zip file: {zip_filename}")
-                    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        zipf.write(nc_path, nc_filename)
-                    
-                    # Cleanup
-                    try:
-                        nc_path.unlink(missing_ok=True)  # keep only the zip
-                    except Exception:
-                        pass
-                    combined.close()
+                    if Config.OUTPUT_FORMAT == 'zarr':
+                        store_name = f"HYCOM_combined_{timestamp}.zarr"
+                        logger.info(f"Creating zip file: {zip_filename} ({store_name})")
+                        write_engine_used = write_zarr_archive(combined, zip_path, store_name,
+                                                               chunks=Config.ZARR_CHUNKS)
+                    else:
+                        nc_filename = f"HYCOM_combined_{timestamp}.nc"
+                        # Encoding only for numeric variables (compression-ready)
+                        encoding = build_encoding(combined)
+                        
+                        logger.info(f"Creating zip file: {zip_filename} ({nc_filename})")
+                        # NetCDF is written once, directly into the archive
+                        write_engine_used = write_zip_archive(combined, zip_path, nc_filename, encoding,
+                                                              chunks=Config.WRITE_CHUNKS)
+                    invalidate_files_cache()
                     
                     vars_list = list(combined.data_vars) if hasattr(combined, 'data_vars') else []
                     dims_dict = dict(combined.dims) if hasattr(combined, 'dims') else {}
                     
+                    # Release the month's arrays and source handles before the next month
+                    combined.close()
+                    del combined
+                    gc.collect()
+                    remove_source_files(downloaded_files_month)
+                    
                     logger.info(f"Successfully created: {zip_filename}")
                     logger.info(f"Write engine: {write_engine_used}")
                     logger.info(f"Variables: {vars_list}")
@@ -347,37 +482,35 @@ def download_worker():
                         logger.info(f"Time steps: {dims_dict['time']}")
                     logger.info(f"Location: {zip_path}")
                     
-                    download_status['status_message'] = f"Created {zip_filename} for {month_start.strftime('%Y-%m')}"
+                    missing_note = f" ({len(lost_items)} files missing)" if lost_items else ""
+                    update_status(status_message=f"Created {zip_filename} for {month_start.strftime('%Y-%m')}{missing_note}")
                     
                 except Exception as e:
+                    incomplete = True
                     logger.error(f"Failed to process files for {month_start.strftime('%Y-%m')}: {e}")
-                    download_status['error'] = f"Failed to combine files for {month_start.strftime('%Y-%m')}: {str(e)}"
+                    update_status(error=f"Failed to combine files for {month_start.strftime('%Y-%m')}: {str(e)}")
             else:
+                incomplete = True
                 logger.warning(f"No files downloaded for {month_start.strftime('%Y-%m')}!")
-            
-            # Move to next month
-            if current_date.month == 12:
-                current_date = datetime(current_date.year + 1, 1, 1)
-            else:
-                current_date = datetime(current_date.year, current_date.month + 1, 1)
         
         # Final status
-        if download_status['is_running']:
-            download_status.update({
+        if not stop_requested.is_set():
+            update_status(**{
                 'is_running': False,
                 'status_message': f'Download completed! Downloaded {len(downloaded_files)} files',
                 'end_time': datetime.now().isoformat()
             })
         else:
-            download_status.update({
+            update_status(**{
                 'status_message': 'Download stopped by user',
                 'end_time': datetime.now().isoformat()
             })
         
         logger.info("Download process completed")
+        completed = not stop_requested.is_set() and not incomplete
         
     except Exception as e:
-        download_status.update({
+        update_status(**{
             'is_running': False,
             'error': str(e),
             'status_message': f'Download failed: {str(e)}',
@@ -385,14 +518,19 @@ def download_worker():
         })
         logger.error(f"Download worker error: {e}")
     finally:
-        # Cleanup temporary directory
+        # Cleanup temporary directory only after a fully successful run; a stopped,
+        # failed or partial run keeps its downloads and .part files for the next one
         temp_dir = Path(Config.TEMP_DIR)
-        if temp_dir.exists():
+        if not completed:
+            logger.info(f"Keeping {temp_dir} so a re-run can reuse and resume its downloads")
+        elif temp_dir.exists():
             logger.info("Cleaning up temporary directory...")
             try:
                 shutil.rmtree(temp_dir)
             except Exception as e:
                 logger.warning(f"Failed to cleanup temp directory: {e}")
+        # Only now may a new download start (it would otherwise lose TEMP_DIR)
+        _worker_active.clear()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
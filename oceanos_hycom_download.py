@@ -6,31 +6,63 @@ Features:
 - Requests NetCDF4/HDF5 from HYCOM NCSS (accept=netcdf4)
 - Safe open that prefers h5netcdf (installed), then autodetect, then scipy
 - Month-end capping to respect DATE_END
-- Cheap validation (no full array read)
-- Handles missing Content-Length in tqdm
+- Optional multi-day NCSS requests (DAYS_PER_REQUEST > 1, off by default) fetching only the daily 12:00Z steps
+- Cheap validation (Content-Type + HDF5 signature, no dataset open)
+- Per-file progress (one tqdm tick per finished download)
+- Resumes interrupted downloads from '.part' files via HTTP Range requests
+- Reuses finished downloads left in TEMP_DIR for the same bounding box (re-runs are idempotent)
 - Compressed NetCDF writing via h5netcdf; falls back to scipy if needed
+- Optional Zarr output (Blosc zstd + bitshuffle, time/space chunks) with OUTPUT_FORMAT = 'zarr'
 
 Public API (used by Flask app):
 - Config
-- get_hycom_url(date: datetime, var: str) -> str
-- download_file_with_retry(date: datetime, var: str) -> Optional[Path]
-- redownload_failed(failed_items, attempts=1) -> (List[Path], List[Tuple[datetime,str]])
-- combine_files(files: List[Path]) -> xr.Dataset
+- get_hycom_url(date: datetime, var: str, bbox=None, end_date=None) -> str
+- create_session(pool_size: int) -> requests.Session
+- get_session() -> requests.Session
+- download_dir(bbox=None) -> Path
+- download_filename(date: datetime, var: str, end_date=None) -> str
+- download_item(path: Path) -> Optional[tuple]
+- download_variable(path: Path) -> Optional[str]
+- build_download_items(dates: List[datetime], variables: List[str]) -> List[tuple]
+- is_valid_download(path: Path) -> bool
+- download_file_with_retry(date: datetime, var: str, end_date=None, session=None, should_stop=None) -> Optional[Path]
+- download_many(items, max_workers=None, session=None, should_stop=None) -> Iterator[(item, Optional[Path])]
+- redownload_failed(failed_items, attempts=1) -> (List[Path], List[item])
+- combine_files(files: List[Path], chunks=None, parallel=True, dropped=None) -> xr.Dataset
+- combine_with_redownload(files: List[Path], chunks=None, parallel=True, attempts=1) -> (xr.Dataset, List[item])
 - safe_open_dataset(path: Path) -> xr.Dataset
-- write_netcdf_with_fallback(ds: xr.Dataset, nc_path: Path, encoding: dict) -> str
+- build_encoding(ds: xr.Dataset) -> dict
+- write_netcdf_with_fallback(ds: xr.Dataset, nc_path: Path, encoding: dict, chunks=None) -> str
+- write_zip_archive(ds: xr.Dataset, zip_path: Path, nc_filename: str, encoding: dict, chunks=None) -> str
+- build_zarr_encoding(ds: xr.Dataset) -> dict
+- write_zarr_archive(ds: xr.Dataset, zip_path: Path, store_name: str, chunks=None) -> str
+- remove_source_files(files: List[Path]) -> None
 - main() -> None (for standalone execution)
+
+Download items are (date, var) for one day or (start, var, end) for a multi-day request.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 import pandas as pd
 import xarray as xr
 import zipfile
 import shutil
 import logging
+import os
+import contextlib
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 from tqdm import tqdm
+import math
+import gc
+import threading
 import time
 
 # ---------------------------
@@ -58,7 +90,24 @@ class Config:
     # Download settings
     MAX_RETRIES = 3
     TIMEOUT = 60
-    CHUNK_SIZE = 8192
+    CHUNK_SIZE = 64 * 1024  # read size when streaming to disk; a dropped connection loses at most one read
+    MAX_WORKERS = 8  # concurrent HTTP downloads per month
+    DAYS_PER_REQUEST = 1   # days per NCSS request and variable; >1 is unverified against the live server
+    STEPS_PER_DAY = 8      # model steps per day in the dataset (GLBy0.08 is 3-hourly); timeStride for spans
+    MIN_VALID_NC_SIZE = 1024  # bytes; smaller leftovers are re-downloaded
+
+    # Output settings
+    NC_COMPRESSION = 'zlib'  # 'zlib' or 'lzf' (faster; readable via h5py/h5netcdf only, not netCDF-C)
+    NC_COMPLEVEL = 1      # zlib level for the combined NetCDF (1 = fast, 9 = smallest)
+    NC_CHUNKS = {'time': 1, 'depth': 10, 'lat': 256, 'lon': 256}  # HDF5 chunk shape per dim (capped by size)
+    ZIP_COMPRESS = False  # deflate the zip too (NetCDF is already compressed)
+    PACK_INT16 = True     # store float fields as int16 + scale_factor (HYCOM's native packing)
+    COMBINE_CHUNKS = {'time': 1, 'lat': 512, 'lon': 512}  # Dask tiles used when combining a month
+    WRITE_CHUNKS = {'time': 1}  # stream the combined NetCDF write one day at a time
+    WRITE_THREADS = None        # Dask threads for read/encode during the write (None = cores - 1)
+    OUTPUT_FORMAT = 'netcdf'    # 'netcdf' or 'zarr' (chunked Zarr store inside the monthly zip)
+    ZARR_CHUNKS = {'time': 31, 'depth': 10, 'lat': -1, 'lon': -1}  # Zarr chunk shape (-1 = whole dim)
+    ZARR_CLEVEL = 5             # Blosc zstd level for Zarr chunks
 
     @classmethod
     def setup_directories(cls):
@@ -83,15 +132,76 @@ base_dir, temp_dir = config.setup_directories()
 # ---------------------------
 # Helpers
 # ---------------------------
-def get_hycom_url(date: datetime, var: str) -> str:
-    """Generate HYCOM NCSS URL (request NetCDF4/HDF5)."""
-    date_str = date.strftime('%Y-%m-%d')
-    base_url = "https://ncss.hycom.org/thredds/ncss/GLBy0.08/expt_93.0"
+HYCOM_NCSS_URL = "https://ncss.hycom.org/thredds/ncss/GLBy0.08/expt_93.0"
+
+@functools.lru_cache(maxsize=32)
+def _hycom_url_template(bbox: Tuple[float, float, float, float]) -> str:
+    """NCSS URL with the bounds baked in; {var}, {start}, {end} and {stride} are filled per request."""
+    west, east, south, north = bbox
     # Request NetCDF4 to match h5netcdf/NetCDF4 backends
-    return (f"{base_url}?var={var}&north={config.NORTH_LAT}&west={config.WEST_LON}"
-            f"&east={config.EAST_LON}&south={config.SOUTH_LAT}&disableProjSubset=on"
-            f"&horizStride=1&time_start={date_str}T12:00:00Z&time_end={date_str}T12:00:00Z"
-            f"&timeStride=1&addLatLon=true&accept=netcdf4")
+    return (f"{HYCOM_NCSS_URL}?var={{var}}&north={north}&west={west}"
+            f"&east={east}&south={south}&disableProjSubset=on"
+            f"&horizStride=1&time_start={{start}}T12:00:00Z&time_end={{end}}T12:00:00Z"
+            f"&timeStride={{stride}}&addLatLon=true&accept=netcdf4")
+
+@functools.lru_cache(maxsize=4096)
+def _build_hycom_url(start_str: str, end_str: str, var: str,
+                     bbox: Tuple[float, float, float, float], stride: int = 1) -> str:
+    """Memoized URL formatting; bbox = (west, east, south, north) is part of the key."""
+    return _hycom_url_template(bbox).format(var=var, start=start_str, end=end_str, stride=stride)
+
+def _config_bbox() -> Tuple[float, float, float, float]:
+    """Current Config bounds as the (west, east, south, north) key used for URLs and caching."""
+    return (config.WEST_LON, config.EAST_LON, config.SOUTH_LAT, config.NORTH_LAT)
+
+def get_hycom_url(date: datetime, var: str,
+                  bbox: Optional[Tuple[float, float, float, float]] = None,
+                  end_date: Optional[datetime] = None) -> str:
+    """
+    Generate HYCOM NCSS URL (request NetCDF4/HDF5); bbox defaults to the Config bounds.
+    With end_date the single response covers date 12:00Z to end_date 12:00Z with
+    timeStride=Config.STEPS_PER_DAY, i.e. one 12:00Z step per day; combine_files drops
+    any non-12:00Z step that a gap in the archive shifts into the response.
+    """
+    if bbox is None:
+        bbox = _config_bbox()
+    start_str = date.strftime('%Y-%m-%d')
+    end_str = end_date.strftime('%Y-%m-%d') if end_date is not None else start_str
+    stride = 1 if end_str == start_str else max(1, int(config.STEPS_PER_DAY or 1))
+    return _build_hycom_url(start_str, end_str, var, bbox, stride)
+
+def create_session(pool_size: int = 1) -> requests.Session:
+    """
+    Session whose connection pool holds pool_size keep-alive connections, so
+    concurrent downloads reuse TCP/TLS connections instead of reconnecting per file.
+    Connection errors, 429 and transient 5xx responses to GETs are retried by urllib3
+    with exponential backoff, honouring Retry-After.
+    """
+    session = requests.Session()
+    retry = Retry(total=config.MAX_RETRIES, backoff_factor=1,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'],
+                  respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # NetCDF is binary and already compressed; gzip transfer-encoding only costs CPU
+    session.headers.update({'Accept-Encoding': 'identity'})
+    return session
+
+_session = None
+_session_key = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Shared module-level session; rebuilt only when MAX_WORKERS/MAX_RETRIES change."""
+    global _session, _session_key
+    key = (config.MAX_WORKERS, config.MAX_RETRIES)
+    with _session_lock:
+        if _session is None or _session_key != key:
+            if _session is not None:
+                _session.close()
+            _session, _session_key = create_session(config.MAX_WORKERS), key
+        return _session
 
 def safe_open_dataset(path: Path):
     """
@@ -107,59 +217,249 @@ def safe_open_dataset(path: Path):
             last_err = e
     raise last_err if last_err else RuntimeError("Failed to open dataset with any engine")
 
-def download_file_with_retry(date: datetime, var: str) -> Optional[Path]:
-    """Download a single HYCOM file with retry mechanism and cheap validation."""
-    url = get_hycom_url(date, var)
-    filename = f"hycom_{var}_{date.strftime('%Y%m%d')}.nc"
-    filepath = temp_dir / filename
+def _content_range_start(header: Optional[str]) -> Optional[int]:
+    """Parse the first byte position from 'Content-Range: bytes start-end/total'."""
+    try:
+        unit, _, rng = header.partition(' ')
+        if unit != 'bytes':
+            return None
+        return int(rng.split('-', 1)[0])
+    except (AttributeError, ValueError):
+        return None
+
+def _request_resumable(url: str, part_path: Path, etag_path: Path, session=None):
+    """
+    GET url, resuming an existing .part file with an HTTP Range request when possible.
+    Returns (response, file_mode, offset); falls back to a full download from byte 0
+    when the server cannot honour the range (200, 416, or a mismatched Content-Range).
+    """
+    http = session or get_session()
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset > 0:
+        headers = {'Range': f'bytes={offset}-'}
+        if etag_path.exists():
+            # If-Range makes the server send the full body if the partial is stale
+            headers['If-Range'] = etag_path.read_text().strip()
+        resp = http.get(url, timeout=config.TIMEOUT, stream=True, headers=headers)
+        if resp.status_code == 206:
+            if _content_range_start(resp.headers.get('Content-Range')) == offset:
+                logger.info(f"Resuming {part_path.name} from byte {offset}")
+                return resp, 'ab', offset
+        elif resp.status_code != 416:
+            # 200 (range ignored or If-Range mismatch) or an error for raise_for_status
+            return resp, 'wb', 0
+        resp.close()
+        logger.info(f"Cannot resume {part_path.name} (HTTP {resp.status_code}); restarting from zero")
+        part_path.unlink(missing_ok=True)
+    resp = http.get(url, timeout=config.TIMEOUT, stream=True)
+    return resp, 'wb', 0
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+# NCSS serves netCDF4 as application/x-netcdf4 (older servers: x-netcdf / octet-stream)
+NETCDF_CONTENT_TYPES = ('application/x-netcdf', 'application/octet-stream')
+
+def download_dir(bbox: Optional[Tuple[float, float, float, float]] = None) -> Path:
+    """
+    TEMP_DIR subdirectory holding the downloads (and .part/.etag files) of one bounding box.
+    File names carry only var and dates, so keying the directory on the URL template keeps
+    files fetched for another region from being reused or resumed.
+    """
+    key = hashlib.sha1(_hycom_url_template(bbox or _config_bbox()).encode()).hexdigest()[:12]
+    return temp_dir / f"bbox_{key}"
+
+def download_filename(date: datetime, var: str, end_date: Optional[datetime] = None) -> str:
+    """Name of the download for (date, var[, end_date]) inside download_dir()."""
+    if end_date is None or end_date.date() == date.date():
+        return f"hycom_{var}_{date.strftime('%Y%m%d')}.nc"
+    return f"hycom_{var}_{date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}.nc"
+
+def download_item(path: Path) -> Optional[tuple]:
+    """Inverse of download_filename: (date, var) or (start, var, end) for hycom_<var>_<YYYYMMDD>[-<YYYYMMDD>].nc."""
+    if path.suffix != '.nc':
+        return None
+    # var may itself contain '_' (water_temp); the date span is always the last part
+    prefix, _, rest = path.stem.partition('_')
+    var_name, _, span = rest.rpartition('_')
+    if prefix != 'hycom' or not var_name or not span.replace('-', '').isdigit():
+        return None
+    try:
+        days = [datetime.strptime(d, '%Y%m%d') for d in span.split('-')]
+    except ValueError:
+        return None
+    if len(days) == 1:
+        return days[0], var_name
+    if len(days) == 2:
+        return days[0], var_name, days[1]
+    return None
+
+def download_variable(path: Path) -> Optional[str]:
+    """Variable of a download_filename() name, else None."""
+    item = download_item(path)
+    return item[1] if item else None
+
+def expected_time_steps(item: tuple) -> int:
+    """Number of daily 12:00Z steps a (date, var[, end_date]) download should hold."""
+    return (item[2] - item[0]).days + 1 if len(item) == 3 else 1
+
+def build_download_items(dates: List[datetime], variables: List[str]) -> List[tuple]:
+    """
+    Split consecutive days into Config.DAYS_PER_REQUEST-day NCSS requests per variable.
+    Items are (date, var) for a single day or (start, var, end) for a span; unpack
+    them straight into download_file_with_retry / download_filename.
+    """
+    step = max(1, int(config.DAYS_PER_REQUEST or 1))
+    items = []
+    for i in range(0, len(dates), step):
+        span = dates[i:i + step]
+        for var in variables:
+            items.append((span[0], var) if len(span) == 1 else (span[0], var, span[-1]))
+    return items
+
+def is_valid_download(path: Path) -> bool:
+    """
+    Cheap check that a finished download is usable: at least MIN_VALID_NC_SIZE bytes
+    and starting with the HDF5 signature (NetCDF4). Reads 8 bytes, no dataset open.
+    """
+    try:
+        if path.stat().st_size < config.MIN_VALID_NC_SIZE:
+            return False
+        with open(path, 'rb') as fh:
+            return fh.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE
+    except OSError:
+        return False
+
+def _backoff(seconds: float, should_stop: Optional[Callable[[], bool]] = None) -> bool:
+    """Sleep up to seconds, polling should_stop(); returns False if stopped early."""
+    deadline = time.monotonic() + seconds
+    while True:
+        if should_stop is not None and should_stop():
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, 0.25))
+
+def download_file_with_retry(date: datetime, var: str, end_date: Optional[datetime] = None,
+                             session: Optional[requests.Session] = None,
+                             should_stop: Optional[Callable[[], bool]] = None) -> Optional[Path]:
+    """Download a single HYCOM file with retry mechanism and cheap validation.
+
+    With end_date the file holds every day from date to end_date (one NCSS request).
+    Bytes are streamed into '<file>.part' and only renamed to the final name once
+    complete, so a failed attempt resumes from where it stopped instead of byte 0.
+    HTTP-level retries are left to the session's urllib3 Retry; this loop only
+    re-requests when the body transfer or its validation fails, after a 2**attempt s
+    backoff that returns early once should_stop() is True.
+    Uses the shared keep-alive session from get_session() unless one is passed.
+    Validation is header-only (Content-Type + HDF5 signature): the dataset itself
+    is first opened by combine_files.
+    A valid file already in download_dir() (same bounding box) is returned without
+    any HTTP request.
+    """
+    bbox = _config_bbox()
+    url = get_hycom_url(date, var, bbox=bbox, end_date=end_date)
+    filename = download_filename(date, var, end_date)
+    out_dir = download_dir(bbox)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    filepath = out_dir / filename
+    part_path = out_dir / f"{filename}.part"
+    etag_path = out_dir / f"{filename}.etag"
+
+    def discard():
+        for p in (filepath, part_path, etag_path):
+            p.unlink(missing_ok=True)
+
+    # Finished file from an earlier (interrupted) run: no request needed
+    if is_valid_download(filepath):
+        logger.info(f"Reusing cached {filename}")
+        return filepath
 
     for attempt in range(config.MAX_RETRIES):
         try:
             logger.info(f"Downloading {filename} (attempt {attempt + 1}/{config.MAX_RETRIES})")
-            resp = requests.get(url, timeout=config.TIMEOUT, stream=True)
-            resp.raise_for_status()
-
-            total_size = int(resp.headers.get('content-length', 0))
-            with open(filepath, 'wb') as f:
-                with tqdm(total=total_size if total_size > 0 else None,
-                          unit='B', unit_scale=True, desc=filename, leave=False) as pbar:
-                    for chunk in resp.iter_content(chunk_size=config.CHUNK_SIZE):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
-
-            # Cheap validation (no full array read) with safe engine selection
             try:
-                with safe_open_dataset(filepath) as ds:
-                    if (var in ds.data_vars) and (ds[var].size > 0):
-                        logger.info(f"Successfully downloaded: {filename}")
-                        return filepath
-                    else:
-                        logger.warning(f"File {filename} has no data for variable '{var}'")
-            except Exception as e:
-                logger.error(f"Failed to validate file {filename}: {e}")
-
-            if filepath.exists():
-                filepath.unlink()
+                resp, mode, offset = _request_resumable(url, part_path, etag_path, session)
+                resp.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # The session's Retry already retried connects, 429 and 5xx with backoff
+                logger.error(f"Request failed for {filename}: {e}")
+                break
 
-        except requests.exceptions.RequestException as e:
+            if mode == 'wb':
+                # Remember the validator so a later resume can send If-Range
+                etag = resp.headers.get('ETag', '')
+                if etag and not etag.startswith('W/'):
+                    etag_path.write_text(etag)
+                else:
+                    etag_path.unlink(missing_ok=True)
+
+            content_type = resp.headers.get('Content-Type', '')
+            if content_type and not content_type.startswith(NETCDF_CONTENT_TYPES):
+                # NCSS reports bad requests as an HTML/text page; don't save it as .nc
+                logger.warning(f"Unexpected Content-Type '{content_type}' for {filename}")
+                resp.close()
+                discard()
+                continue
+
+            # Progress is reported per file by the callers, not per buffer here
+            with open(part_path, mode) as f:
+                # Session asks for identity encoding; decode_content still handles a gzip reply
+                resp.raw.decode_content = True
+                # Moderate reads: urllib3 discards a partly filled read when the connection
+                # drops, so each read is progress the next attempt can resume from
+                shutil.copyfileobj(resp.raw, f, length=config.CHUNK_SIZE)
+            part_path.replace(filepath)
+            etag_path.unlink(missing_ok=True)
+
+            # Cheap validation: HDF5 signature only; combine_files opens the data anyway
+            if is_valid_download(filepath):
+                logger.info(f"Successfully downloaded: {filename} ({filepath.stat().st_size / 1e6:.1f} MB)")
+                return filepath
+            logger.warning(f"File {filename} is not a NetCDF4/HDF5 file")
+            discard()
+
+        except (requests.exceptions.RequestException, Urllib3HTTPError) as e:
+            # Body cut off mid-stream (resp.raw raises urllib3 errors, which Retry never sees):
+            # keep the .part file and back off here before resuming
             logger.warning(f"Download attempt {attempt + 1} failed for {filename}: {e}")
-            if filepath.exists():
-                filepath.unlink()
             if attempt < config.MAX_RETRIES - 1:
                 wait = 2 ** attempt
-                logger.info(f"Retrying in {wait} seconds...")
-                time.sleep(wait)
+                logger.info(f"Resuming in {wait} seconds...")
+                if not _backoff(wait, should_stop):
+                    logger.info(f"Stop requested; not resuming {filename}")
+                    break
         except Exception as e:
             logger.error(f"Unexpected error downloading {filename}: {e}")
-            if filepath.exists():
-                filepath.unlink()
+            discard()
             break
 
-    logger.error(f"Failed to download {filename} after {config.MAX_RETRIES} attempts")
+    logger.error(f"Failed to download {filename}")
     return None
 
-def redownload_failed(failed_items: List[Tuple[datetime, str]], attempts: int = 1) -> Tuple[List[Path], List[Tuple[datetime, str]]]:
+def download_many(items: List[tuple], max_workers: Optional[int] = None,
+                  session: Optional[requests.Session] = None,
+                  should_stop: Optional[Callable[[], bool]] = None
+                  ) -> Iterator[Tuple[tuple, Optional[Path]]]:
+    """
+    Download (date, var[, end_date]) items concurrently on a thread pool sharing one keep-alive
+    session (HYCOM fetches are network-bound; requests releases the GIL on I/O).
+    Yields (item, path_or_None) in completion order. Once should_stop()
+    returns True, queued items are cancelled and in-flight ones are left to finish
+    (without waiting out a resume backoff).
+    """
+    session = session or get_session()
+    with ThreadPoolExecutor(max_workers=max_workers or config.MAX_WORKERS or 8) as executor:
+        futures = {executor.submit(download_file_with_retry, *item, session=session,
+                                   should_stop=should_stop): item
+                   for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+            if should_stop is not None and should_stop():
+                executor.shutdown(wait=False, cancel_futures=True)
+                break
+
+def redownload_failed(failed_items: List[tuple], attempts: int = 1) -> Tuple[List[Path], List[tuple]]:
+    """Retry failed items; each round runs concurrently through download_many."""
     if not failed_items:
         return [], []
     logger.info(f"Starting redownload pass for {len(failed_items)} failed items (passes={attempts})")
@@ -168,70 +468,159 @@ def redownload_failed(failed_items: List[Tuple[datetime, str]], attempts: int =
         if not remaining:
             break
         current, remaining = remaining, []
-        for date_obj, var in current:
-            path = download_file_with_retry(date_obj, var)
+        for item, path in download_many(current):
             if path:
                 successful.append(path)
             else:
-                remaining.append((date_obj, var))
+                remaining.append(item)
         logger.info(f"Redownload round complete. Recovered {len(successful)} so far. Remaining: {len(remaining)}")
     return successful, remaining
 
-def combine_files(files: List[Path]) -> xr.Dataset:
-    """Combine NetCDF files into one dataset (safe engine opener)."""
+def _open_var_files(var_name: str, file_list: List[Path], chunks: dict, parallel: bool) -> xr.Dataset:
+    """
+    Open one variable's files as a single lazy dataset concatenated along time.
+    Multi-day files are cut down to their 12:00Z steps (one per day, like single-day
+    requests), and each file's step count is checked against its name.
+    Tries h5netcdf then autodetect; if dask is unavailable, retries without chunks.
+    """
+    def keep_var(ds):
+        source = Path(ds.encoding.get('source', ''))
+        ds = ds[[var_name]]
+        steps = ds.sizes.get('time', 1)
+        if steps > 1:
+            # Safety net for span requests: timeStride only lands on 12:00Z while the archive has no gaps
+            try:
+                at_12z = (ds['time'].dt.hour == 12).values
+            except (AttributeError, TypeError):
+                at_12z = None
+            if at_12z is not None and at_12z.any():
+                ds = ds.isel(time=at_12z)
+            else:
+                logger.warning(f"{source.name}: no 12:00Z steps found; keeping all {steps} time steps")
+        item = download_item(source)
+        if item is not None:
+            expected = expected_time_steps(item)
+            steps = ds.sizes.get('time', 1)
+            if steps != expected:
+                # HYCOM archives have occasional gaps; keep what was served
+                logger.warning(f"{source.name} has {steps} daily time steps, expected {expected}")
+        return ds
+
+    last_err = None
+    for eng in ("h5netcdf", None):
+        for ch, par in ((chunks, parallel), (None, False)):
+            try:
+                # Same bbox => identical lat/lon/depth in every file: take them from the
+                # first file instead of comparing and aligning them across all of them
+                return xr.open_mfdataset(file_list, combine='nested', concat_dim='time', engine=eng,
+                                         chunks=ch, parallel=par, preprocess=keep_var,
+                                         data_vars='minimal', coords='minimal',
+                                         compat='override', join='override')
+            except Exception as e:
+                last_err = e
+    raise last_err
+
+def _combine_one_var(var_name: str, file_list: List[Path], chunks: dict,
+                     parallel: bool) -> Tuple[Optional[xr.Dataset], List[Path]]:
+    """
+    Lazy time-concatenated dataset for one variable (None if no file loads) and the
+    files that had to be skipped because they are unreadable or lack the variable.
+    Raises ValueError if the readable files still cannot be combined.
+    """
+    logger.info(f"Combining {len(file_list)} files for variable: {var_name}")
+    file_list = sorted(file_list)
+
+    try:
+        combined_var = _open_var_files(var_name, file_list, chunks, parallel)
+    except Exception as e:
+        # Downloads are only header-checked: drop files that can't be read and retry
+        logger.warning(f"open_mfdataset failed for {var_name} ({e}). Checking files individually.")
+        readable = []
+        for f in file_list:
+            try:
+                with safe_open_dataset(f) as ds:
+                    # Dimension lengths only: no data or coordinate values are read
+                    sizes = ds[var_name].sizes if var_name in ds.data_vars else {}
+                    if sizes and min(sizes.values()) > 0:
+                        readable.append(f)
+                    else:
+                        logger.error(f"{f.name} has no data for variable '{var_name}'")
+            except Exception as open_err:
+                logger.error(f"Failed to open {f}: {open_err}")
+        if not readable:
+            logger.error(f"No valid datasets for variable {var_name}")
+            return None, file_list
+        try:
+            combined_var = _open_var_files(var_name, readable, chunks, parallel)
+        except Exception as retry_err:
+            # The files open fine on their own (e.g. mismatched grids): re-downloading
+            # won't help, so fail loudly and leave them on disk
+            raise ValueError(f"Cannot combine the {len(readable)} readable files for {var_name}: "
+                             f"{retry_err}") from retry_err
+        dropped = [f for f in file_list if f not in readable]
+        logger.info(f"Successfully combined {len(readable)} files for {var_name} "
+                    f"({len(dropped)} dropped)")
+        return combined_var, dropped
+
+    logger.info(f"Successfully combined {len(file_list)} files for {var_name}")
+    return combined_var, []
+
+def combine_files(files: List[Path], chunks: Optional[dict] = None, parallel: bool = True,
+                  dropped: Optional[List[Path]] = None) -> xr.Dataset:
+    """
+    Combine NetCDF files into one dataset (safe engine opener).
+    Each variable is opened with xr.open_mfdataset: files are opened in parallel and
+    arrays stay Dask-backed (chunks={} by default = one chunk per file), so the month is
+    never loaded into memory as a whole; to_netcdf then streams it chunk by chunk.
+    Variables are combined concurrently on a thread pool (_combine_one_var).
+    Files skipped as unreadable are appended to dropped (if given), also when this
+    raises because nothing could be combined; see combine_with_redownload.
+    Readable files that still won't combine raise ValueError without being dropped.
+    """
     if not files:
         raise ValueError("No files provided for combining")
     logger.info(f"Combining {len(files)} files...")
+    chunks = {} if chunks is None else chunks
 
-    import re
     var_files = {}
     for p in files:
-        m = re.match(r'hycom_(.+)_(\d{8})\.nc', p.name)
-        if m:
-            var_files.setdefault(m.group(1), []).append(p)
+        var_name = download_variable(p)
+        if var_name:
+            var_files.setdefault(var_name, []).append(p)
         else:
             logger.warning(f"Could not parse filename: {p.name}")
 
     if not var_files:
         raise ValueError("No valid files found for combining")
 
-    datasets = []
-    for var_name, file_list in var_files.items():
-        logger.info(f"Combining {len(file_list)} files for variable: {var_name}")
-        file_list.sort()
-        var_datasets = []
-        for f in file_list:
-            try:
-                ds = safe_open_dataset(f)
-                var_datasets.append(ds)
-            except Exception as e:
-                logger.error(f"Failed to open {f}: {e}")
-        if not var_datasets:
-            logger.error(f"No valid datasets for variable {var_name}")
-            continue
-
-        # Optional: check dims consistency
-        first_dims = set(var_datasets[0].dims.keys())
-        for ds in var_datasets[1:]:
-            if set(ds.dims.keys()) != first_dims:
-                logger.warning(f"Dimension mismatch in {var_name} files")
-
-        combined_var = xr.concat(var_datasets, dim='time')
-        datasets.append(combined_var)
-        logger.info(f"Successfully combined {len(var_datasets)} files for {var_name}")
-
-        # Close children (concat holds references)
-        for ds in var_datasets:
-            try:
+    # Variables are independent: open them concurrently (files within each are opened in parallel too)
+    with ThreadPoolExecutor(max_workers=len(var_files)) as executor:
+        futures = [executor.submit(_combine_one_var, var_name, file_list, chunks, parallel)
+                   for var_name, file_list in var_files.items()]
+    results, errors = [], []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        # Don't leak the variables that did open
+        for ds, _ in results:
+            if ds is not None:
                 ds.close()
-            except Exception:
-                pass
+        raise errors[0]
+    datasets = [ds for ds, _ in results if ds is not None]
+    if dropped is not None:
+        for _, skipped in results:
+            dropped.extend(skipped)
 
     if not datasets:
         raise ValueError("No datasets could be combined")
 
     try:
         final = xr.merge(datasets)
+        # Closing the merged dataset releases the per-variable source files
+        final.set_close(lambda: [ds.close() for ds in datasets])
         final.attrs.update({
             'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'source': 'HYCOM',
@@ -248,25 +637,235 @@ def combine_files(files: List[Path]) -> xr.Dataset:
                 pass
         raise
 
-def write_netcdf_with_fallback(ds: xr.Dataset, nc_path: Path, encoding: dict):
+def combine_with_redownload(files: List[Path], chunks: Optional[dict] = None, parallel: bool = True,
+                            attempts: int = 1) -> Tuple[xr.Dataset, List[tuple]]:
+    """
+    combine_files, then fetch the files it dropped again and recombine. Downloads are
+    only header-checked, so a truncated or corrupt file first shows up here.
+    Dropped files are deleted before the re-fetch. Returns (dataset, lost_items):
+    the download items still missing from the dataset.
+    """
+    dropped: List[Path] = []
+    try:
+        combined = combine_files(files, chunks, parallel, dropped=dropped)
+    except ValueError:
+        if not dropped:
+            raise
+        combined = None
+    if not dropped:
+        return combined, []
+
+    logger.warning(f"{len(dropped)} unreadable downloads dropped while combining; downloading them again")
+    remove_source_files(dropped)
+    items = [item for item in (download_item(p) for p in dropped) if item is not None]
+    recovered, lost = redownload_failed(items, attempts)
+    if recovered:
+        if combined is not None:
+            combined.close()
+        bad = set(dropped)
+        again: List[Path] = []
+        combined = combine_files([p for p in files if p not in bad] + recovered, chunks, parallel,
+                                 dropped=again)
+        if again:
+            logger.error(f"{len(again)} files still unreadable after redownload")
+            remove_source_files(again)
+            lost += [item for item in (download_item(p) for p in again) if item is not None]
+    elif combined is None:
+        raise ValueError("No datasets could be combined")
+    return combined, lost
+
+# HYCOM's own int16 packing for GLBy0.08 fields: name -> (scale_factor, add_offset)
+HYCOM_PACKING = {
+    'water_u': (0.001, 0.0),
+    'water_v': (0.001, 0.0),
+    'water_temp': (0.001, 20.0),
+    'salinity': (0.001, 20.0),
+    'surf_el': (0.001, 0.0),
+}
+_INT16_FILL = -32768
+
+def _int16_packing(name: str, da: xr.DataArray) -> Optional[Tuple[float, float]]:
+    """(scale_factor, add_offset) mapping da onto int16, or None if it cannot be packed."""
+    if name in HYCOM_PACKING:
+        return HYCOM_PACKING[name]
+    try:
+        import dask
+        # One pass over a lazy month instead of separate reads for min and max
+        lo, hi = dask.compute(da.min(), da.max())
+    except ImportError:
+        lo, hi = da.min(), da.max()  # numpy-backed without dask
+    vmin, vmax = float(lo), float(hi)
+    if not (math.isfinite(vmin) and math.isfinite(vmax)):
+        return None
+    span = vmax - vmin
+    # Spread the data over [-32767, 32767]; -32768 is reserved for _FillValue
+    return (span / 65534 if span > 0 else 1.0), (vmin + vmax) / 2
+
+def build_encoding(ds: xr.Dataset) -> dict:
+    """
+    NetCDF encoding for the combined dataset: shuffle + zlib (or LZF with
+    Config.NC_COMPRESSION = 'lzf', h5netcdf writes only) on every numeric variable,
+    on Config.NC_CHUNKS-sized HDF5 chunks, and, with Config.PACK_INT16, float fields
+    stored as int16 + scale_factor/add_offset (HYCOM's native packing), halving the
+    bytes the compressor and readers touch.
+    """
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        if da.dtype.kind not in "ifub":
+            continue
+        if config.NC_COMPRESSION == 'lzf':
+            enc = {'compression': 'lzf', 'shuffle': True}
+        else:
+            enc = {'zlib': True, 'complevel': config.NC_COMPLEVEL, 'shuffle': True}
+        if da.ndim and all(da.shape):
+            # Few large HDF5 chunks instead of libhdf5's many tiny default ones
+            enc['chunksizes'] = tuple(min(size, config.NC_CHUNKS.get(dim, size))
+                                      for dim, size in zip(da.dims, da.shape))
+        if config.PACK_INT16 and da.dtype.kind == "f":
+            packing = _int16_packing(name, da)
+            if packing:
+                scale_factor, add_offset = packing
+                enc.update({'dtype': 'int16', 'scale_factor': scale_factor,
+                            'add_offset': add_offset, '_FillValue': _INT16_FILL})
+        encoding[name] = enc
+    return encoding
+
+def _rechunk(ds: xr.Dataset, chunks: Optional[dict]) -> xr.Dataset:
+    """Dask-chunk ds along the given (existing) dims so writes stream chunk by chunk."""
+    chunks = {dim: size for dim, size in (chunks or {}).items() if dim in ds.dims}
+    if not chunks:
+        return ds
+    try:
+        return ds.chunk(chunks)
+    except Exception as e:  # dask not installed
+        logger.warning(f"Could not chunk dataset for streaming write ({e}). Writing unchunked.")
+        return ds
+
+def _dask_threads():
+    """
+    Context running Dask computations on the threaded scheduler with
+    Config.WRITE_THREADS workers (default: all cores but one); no-op without dask.
+    """
+    try:
+        import dask
+    except ImportError:
+        return contextlib.nullcontext()
+    workers = config.WRITE_THREADS or max(1, (os.cpu_count() or 2) - 1)
+    return dask.config.set(scheduler='threads', num_workers=workers)
+
+def write_netcdf_with_fallback(ds: xr.Dataset, nc_path: Path, encoding: dict,
+                               chunks: Optional[dict] = None):
     """
     Try to write with h5netcdf (compression). If that fails, fall back to scipy (no compression).
+    With chunks (e.g. {'time': 1}) the data is written one Dask chunk at a time, so
+    only one chunk of the inputs is held in memory.
     """
+    ds = _rechunk(ds, chunks)
     try:
         import h5netcdf  # probe availability
-        ds.to_netcdf(nc_path, engine="h5netcdf", encoding=encoding)
+        with _dask_threads():
+            ds.to_netcdf(nc_path, engine="h5netcdf", encoding=encoding, compute=True)
         return "h5netcdf (compressed)"
     except Exception as e:
         logger.warning(f"h5netcdf write failed ({e}). Falling back to scipy without compression.")
         ds.to_netcdf(nc_path, engine="scipy")
         return "scipy (uncompressed)"
 
+_ZIP_COPY_BUFSIZE = 8 * 1024 * 1024
+
+def write_zip_archive(ds: xr.Dataset, zip_path: Path, nc_filename: str, encoding: dict,
+                      chunks: Optional[dict] = None) -> str:
+    """
+    Write ds as NetCDF entry nc_filename of the zip at zip_path.
+    The NetCDF goes through a temporary .nc in TEMP_DIR, since HDF5 must seek back
+    into its output and a zip entry handle is write-only. Returns the engine used.
+    chunks is passed on to the write so inputs are streamed (see write_netcdf_with_fallback).
+    """
+    nc_path = config.TEMP_DIR / nc_filename
+    try:
+        engine_used = write_netcdf_with_fallback(ds, nc_path, encoding, chunks)
+
+        # h5netcdf output is already zlib-compressed; deflate only the scipy fallback or on request
+        compressed_nc = engine_used.startswith('h5netcdf')
+        zip_compression = zipfile.ZIP_DEFLATED if (config.ZIP_COMPRESS or not compressed_nc) else zipfile.ZIP_STORED
+
+        with zipfile.ZipFile(zip_path, 'w', zip_compression, allowZip64=True) as zipf:
+            # 8 MiB copies instead of zipfile.write's 8 KiB reads
+            with open(nc_path, 'rb') as src, zipf.open(nc_filename, 'w', force_zip64=True) as zf:
+                shutil.copyfileobj(src, zf, length=_ZIP_COPY_BUFSIZE)
+    finally:
+        nc_path.unlink(missing_ok=True)  # keep only the zip
+    return engine_used
+
+def build_zarr_encoding(ds: xr.Dataset) -> dict:
+    """
+    Zarr encoding for the combined dataset: Blosc zstd (Config.ZARR_CLEVEL) with bit shuffle
+    on every numeric variable, plus the same int16 packing as build_encoding.
+    Works with zarr-python 2 (numcodecs compressor) and 3 (codec pipeline).
+    """
+    import zarr
+    if int(zarr.__version__.split('.')[0]) >= 3:
+        from zarr.codecs import BloscCodec
+        codec = {'compressors': [BloscCodec(cname='zstd', clevel=config.ZARR_CLEVEL, shuffle='bitshuffle')]}
+    else:
+        from numcodecs import Blosc
+        codec = {'compressor': Blosc(cname='zstd', clevel=config.ZARR_CLEVEL, shuffle=Blosc.BITSHUFFLE)}
+
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        if da.dtype.kind not in "ifub":
+            continue
+        enc = dict(codec)
+        if config.PACK_INT16 and da.dtype.kind == "f":
+            packing = _int16_packing(name, da)
+            if packing:
+                scale_factor, add_offset = packing
+                enc.update({'dtype': 'int16', 'scale_factor': scale_factor,
+                            'add_offset': add_offset, '_FillValue': _INT16_FILL})
+        encoding[name] = enc
+    return encoding
+
+def write_zarr_archive(ds: xr.Dataset, zip_path: Path, store_name: str,
+                       chunks: Optional[dict] = None) -> str:
+    """
+    Write ds as a Zarr store (directory store_name inside the zip at zip_path).
+    The store is built in TEMP_DIR with Config.ZARR_CHUNKS-shaped chunks (Dask
+    writes them in parallel) and then stored uncompressed: Blosc already
+    compressed every chunk. Returns the engine used.
+    """
+    store_path = config.TEMP_DIR / store_name
+    shutil.rmtree(store_path, ignore_errors=True)
+    ds = _rechunk(ds, chunks or config.ZARR_CHUNKS)
+    try:
+        encoding = build_zarr_encoding(ds)
+        with _dask_threads():
+            ds.to_zarr(store_path, mode='w', encoding=encoding, consolidated=True)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            for root, _, names in os.walk(store_path):
+                for name in sorted(names):
+                    path = Path(root) / name
+                    zipf.write(path, Path(store_name) / path.relative_to(store_path))
+    finally:
+        shutil.rmtree(store_path, ignore_errors=True)  # keep only the zip
+    return "zarr (blosc zstd, bitshuffle)"
+
+def remove_source_files(files: List[Path]) -> None:
+    """Delete per-day downloads once their month is archived (caps peak disk usage)."""
+    for p in files:
+        try:
+            Path(p).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not remove {p}: {e}")
+
 # ---------------------------
 # Main (for standalone execution)
 # ---------------------------
 def main():
     logger.info("Starting HYCOM Data Download - Monthly Processing")
     logger.info("=" * 50)
+    # completed only turns True once every month was archived in full (not on error/Ctrl-C)
+    completed = False
+    incomplete = False
     try:
         start_date_obj = datetime.strptime(config.DATE_START, '%Y-%m-%d')
         end_date_obj   = datetime.strptime(config.DATE_END,   '%Y-%m-%d')
@@ -289,28 +888,29 @@ def main():
             if month_end < month_start:
                 break
 
-            dates_in_month = pd.date_range(start=month_start, end=month_end, freq='D')
-            total_files_month = len(dates_in_month) * len(config.VARIABLES)
+            dates_in_month = list(pd.date_range(start=month_start, end=month_end, freq='D'))
+            tasks = build_download_items(dates_in_month, config.VARIABLES)
+            total_files_month = len(tasks)
 
             logger.info(f"\nProcessing month: {month_start.strftime('%Y-%m')} (capped end: {month_end.strftime('%Y-%m-%d')})")
-            downloaded_files_month: List[Path] = []
-            failed_items: List[Tuple[datetime, str]] = []
+            # One result slot per task: results come back in request order whatever the completion order
+            results: List[Optional[Path]] = [None] * total_files_month
+            slots = {item: i for i, item in enumerate(tasks)}
 
             with tqdm(total=total_files_month, desc=f"Downloading {month_start.strftime('%Y-%m')}") as pbar:
-                for date in dates_in_month:
-                    for var in config.VARIABLES:
-                        path = download_file_with_retry(date, var)
-                        if path:
-                            downloaded_files_month.append(path)
-                        else:
-                            failed_items.append((date, var))
-                        pbar.update(1)
+                for item, path in download_many(tasks):
+                    results[slots[item]] = path
+                    pbar.update(1)
+
+            downloaded_files_month = [p for p in results if p]
+            failed_items = [item for item, p in zip(tasks, results) if not p]
 
             if failed_items:
                 logger.warning(f"Initial failures: {len(failed_items)}. Attempting redownload pass...")
                 recovered, remaining = redownload_failed(failed_items, attempts=1)
                 downloaded_files_month.extend(recovered)
                 if remaining:
+                    incomplete = True
                     logger.warning(f"Still failed after redownload: {len(remaining)} items")
 
             logger.info(f"Downloaded {len(downloaded_files_month)}/{total_files_month} files for {month_start.strftime('%Y-%m')}")
@@ -318,34 +918,38 @@ def main():
             if downloaded_files_month:
                 try:
                     logger.info(f"Combining files for {month_start.strftime('%Y-%m')}...")
-                    combined = combine_files(downloaded_files_month)
+                    combined, lost_items = combine_with_redownload(downloaded_files_month,
+                                                                   chunks=config.COMBINE_CHUNKS, parallel=True)
+                    if lost_items:
+                        incomplete = True
+                        logger.warning(f"{len(lost_items)} files unreadable and missing from "
+                                       f"{month_start.strftime('%Y-%m')}: "
+                                       f"{[download_filename(*item) for item in lost_items]}")
 
                     timestamp   = month_start.strftime('%Y%m')
-                    nc_filename = f"HYCOM_combined_{timestamp}.nc"
                     zip_filename = f"HYCOM_data_{timestamp}.zip"
-                    nc_path  = base_dir / nc_filename
                     zip_path = base_dir / zip_filename
 
-                    # Encoding only for numeric variables (compression-ready)
-                    encoding = {}
-                    for name, da in combined.data_vars.items():
-                        if da.dtype.kind in "ifub":
-                            encoding[name] = {'zlib': True, 'complevel': 6}
-
-                    logger.info(f"Saving NetCDF file: {nc_filename}")
-                    write_engine_used = write_netcdf_with_fallback(combined, nc_path, encoding)
+                    if config.OUTPUT_FORMAT == 'zarr':
+                        store_name = f"HYCOM_combined_{timestamp}.zarr"
+                        logger.info(f"Creating zip file: {zip_filename} ({store_name})")
+                        write_engine_used = write_zarr_archive(combined, zip_path, store_name,
+                                                               chunks=config.ZARR_CHUNKS)
+                    else:
+                        nc_filename = f"HYCOM_combined_{timestamp}.nc"
+                        # Encoding only for numeric variables (compression-ready)
+                        encoding = build_encoding(combined)
 
-                    logger.info(f"Creating zip file: {zip_filename}")
-                    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        zipf.write(nc_path, nc_filename)
+                        logger.info(f"Creating zip file: {zip_filename} ({nc_filename})")
+                        write_engine_used = write_zip_archive(combined, zip_path, nc_filename, encoding,
+                                                              chunks=config.WRITE_CHUNKS)
 
                     vars_list = list(combined.data_vars)
                     dims_dict = dict(combined.dims)
-                    try:
-                        nc_path.unlink(missing_ok=True)  # keep only the zip
-                    except Exception:
-                        pass
                     combined.close()
+                    del combined
+                    gc.collect()
+                    remove_source_files(downloaded_files_month)
 
                     logger.info(f"Successfully created: {zip_filename}")
                     logger.info(f"Write engine: {write_engine_used}")
@@ -355,8 +959,10 @@ def main():
                     logger.info(f"Location: {zip_path}")
 
                 except Exception as e:
+                    incomplete = True
                     logger.error(f"Failed to process files for {month_start.strftime('%Y-%m')}: {e}")
             else:
+                incomplete = True
                 logger.warning(f"No files downloaded for {month_start.strftime('%Y-%m')}!")
 
             # Next month
@@ -365,11 +971,16 @@ def main():
             else:
                 current_date = datetime(current_date.year, current_date.month + 1, 1)
 
+        completed = not incomplete
     except Exception as e:
         logger.error(f"Fatal error in main execution: {e}")
         raise
     finally:
-        if temp_dir.exists():
+        # Only a fully successful run clears TEMP_DIR; otherwise its downloads and
+        # .part files are reused/resumed by the next run
+        if not completed:
+            logger.info(f"Keeping {temp_dir} so a re-run can reuse and resume its downloads")
+        elif temp_dir.exists():
             logger.info("Cleaning up temporary directory...")
             shutil.rmtree(temp_dir)
         logger.info("Download process completed!")
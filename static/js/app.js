@@ -5,6 +5,7 @@
 
 // Global variables
 let statusPollingInterval;
+let statusEventSource;
 let isDownloadRunning = false;
 
 // Initialize application when DOM is ready
@@ -169,7 +170,8 @@ function getConfigurationData() {
         date_end: $('#dateEnd').val(),
         variables: variables,
         max_retries: parseInt($('#maxRetries').val()),
-        timeout: parseInt($('#timeout').val())
+        timeout: parseInt($('#timeout').val()),
+        max_workers: parseInt($('#maxWorkers').val())
     };
 }
 
@@ -188,6 +190,7 @@ function loadConfiguration() {
             $('#dateEnd').val(config.date_end);
             $('#maxRetries').val(config.max_retries);
             $('#timeout').val(config.timeout);
+            $('#maxWorkers').val(config.max_workers);
             
             // Set variables
             $('input[type="checkbox"]').prop('checked', false);
@@ -327,12 +330,24 @@ function stopDownload() {
  * Start polling for status updates
  */
 function startStatusPolling() {
-    // Clear any existing interval
+    // Clear any existing interval / stream
     if (statusPollingInterval) {
         clearInterval(statusPollingInterval);
     }
+    if (statusEventSource) {
+        statusEventSource.close();
+    }
     
-    // Poll every 2 seconds
+    // Prefer server-pushed updates (sent only when the status changes)
+    if (window.EventSource) {
+        statusEventSource = new EventSource('/api/status/stream');
+        statusEventSource.onmessage = function(event) {
+            updateStatus(JSON.parse(event.data));
+        };
+        return;
+    }
+    
+    // Fallback: poll every 2 seconds
     statusPollingInterval = setInterval(function() {
         $.get('/api/status')
             .done(function(status) {
@@ -630,6 +645,9 @@ $(window).on('beforeunload', function() {
     if (statusPollingInterval) {
         clearInterval(statusPollingInterval);
     }
+    if (statusEventSource) {
+        statusEventSource.close();
+    }
 });
 
 // Export functions for global access